@@ -1,15 +1,15 @@
 import os
-import json
 import time
-import glob
 import hashlib
+import asyncio
 import logging
 from typing import Any, Dict, Optional
 
+import orjson
 from rq import get_current_job
 
 from app.redis_client import get_redis
-from app.ytdlp_utils import build_watch_url, run_ytdlp_download
+from app.ytdlp_utils import build_watch_url, run_ytdlp_download_async
 
 logger = logging.getLogger("jobs")
 
@@ -20,69 +20,112 @@ MEDIA_ROOT = os.getenv("MEDIA_ROOT", "/data")
 INFO_TTL_SECONDS = int(os.getenv("INFO_TTL_SECONDS", "21600"))  # 6 hours
 
 
+# Content types for the containers yt-dlp produces here (no mimetypes lookup per request)
+_MIME = {
+    ".mp4": "video/mp4",
+    ".m4a": "audio/mp4",
+    ".webm": "video/webm",
+    ".m4s": "video/iso.segment",
+    ".ts": "video/mp2t",
+    ".m3u8": "application/vnd.apple.mpegurl",
+}
+
+
 # ---------------------------------------------------------------------------
 # Helper functions
 # ---------------------------------------------------------------------------
 
-def _b(s: str) -> bytes:
-    """Encode string to UTF-8 bytes."""
-    return s.encode("utf-8")
-
-
-def _hash(s: str) -> str:
-    """Generate a stable hash for cache keys."""
-    return hashlib.sha256(s.encode("utf-8")).hexdigest()
+def media_type_for(path: str) -> str:
+    """Return the Content-Type for a cached media file based on its extension."""
+    return _MIME.get(os.path.splitext(path)[1].lower(), "application/octet-stream")
 
 
-def _pick_newest_nonempty(paths: list[str]) -> Optional[str]:
+def _file_meta(kind: str, path: str) -> Dict[str, Any]:
     """
-    Pick the most recently modified file that is non-empty.
+    Stat a finished output file once and return its response metadata
+    (size, mtime, content type, etag) as payload fields prefixed with `kind`.
+    """
+    st = os.stat(path)
+    mtime = int(st.st_mtime)
+    etag = hashlib.sha1(f"{path}:{mtime}:{st.st_size}".encode("utf-8")).hexdigest()[:16]
+    return {
+        f"{kind}_size": st.st_size,
+        f"{kind}_mtime": mtime,
+        f"{kind}_mime": media_type_for(path),
+        f"{kind}_etag": etag,
+    }
+
+
+def _pick_newest_nonempty_prefixed(root: str, prefix: str) -> Optional[str]:
+    """
+    Pick the most recently modified non-empty file in `root` whose name starts with `prefix`.
     This is important because yt-dlp may leave partial/empty files on failure.
+
+    Uses a single os.scandir pass so each entry is stat'ed at most once.
     """
-    candidates = [p for p in paths if os.path.isfile(p) and os.path.getsize(p) > 0]
-    if not candidates:
-        return None
-    candidates.sort(key=lambda p: os.path.getmtime(p), reverse=True)
-    return candidates[0]
+    best: Optional[str] = None
+    best_mtime = 0.0
+    with os.scandir(root) as it:
+        for entry in it:
+            if not entry.name.startswith(prefix) or not entry.is_file(follow_symlinks=False):
+                continue
+            st = entry.stat(follow_symlinks=False)
+            if st.st_size > 0 and (best is None or st.st_mtime > best_mtime):
+                best, best_mtime = entry.path, st.st_mtime
+    return best
+
+
+async def _download_streams(video_args: list[str], audio_args: list[str]):
+    """Run the video-only and audio-only yt-dlp downloads side by side."""
+    return await asyncio.gather(
+        run_ytdlp_download_async(video_args, timeout_seconds=1800),
+        run_ytdlp_download_async(audio_args, timeout_seconds=1800),
+    )
 
 
 # ---------------------------------------------------------------------------
 # Redis key helpers
 # ---------------------------------------------------------------------------
 
-def k_media(video_id: str) -> str:
+def k_media(video_id: str) -> bytes:
     """Redis key for cached media metadata."""
-    return f"yt:media:{video_id}"
+    return b"yt:media:" + video_id.encode()
 
 
-def k_lock(video_id: str) -> str:
+def k_lock(video_id: str) -> bytes:
     """Redis key for enqueue lock."""
-    return f"yt:lock:{video_id}"
+    return b"yt:lock:" + video_id.encode()
 
 
 # ---------------------------------------------------------------------------
 # Redis access helpers
 # ---------------------------------------------------------------------------
 
-def store_media(video_id: str, payload: Dict[str, Any]) -> None:
-    """Store media metadata in Redis."""
-    r = get_redis()
-    r.set(_b(k_media(video_id)), json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+def parse_media(raw: Optional[bytes]) -> Optional[Dict[str, Any]]:
+    """Decode a raw media metadata value read from Redis."""
+    if not raw:
+        return None
+    return orjson.loads(raw)
 
 
 def get_media(video_id: str) -> Optional[Dict[str, Any]]:
     """Retrieve media metadata from Redis."""
     r = get_redis()
-    raw = r.get(_b(k_media(video_id)))
-    if not raw:
-        return None
-    return json.loads(raw.decode("utf-8"))
+    return parse_media(r.get(k_media(video_id)))
+
+
+def store_media_and_release_lock(video_id: str, payload: Dict[str, Any]) -> None:
+    """Store media metadata and release the enqueue lock in one round-trip."""
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.set(k_media(video_id), orjson.dumps(payload))
+    pipe.delete(k_lock(video_id))
+    pipe.execute()
 
 
 def release_lock(video_id: str) -> None:
     """Release enqueue lock for a video."""
     r = get_redis()
-    r.delete(_b(k_lock(video_id)))
+    r.delete(k_lock(video_id))
 
 
 # ---------------------------------------------------------------------------
@@ -168,24 +211,23 @@ def download_av_job(video_id: str) -> Dict[str, Any]:
         watch_url,
     ]
 
+    lock_released = False
+
     try:
         # -------------------------------------------------------------------
-        # Download video-only
+        # Download video-only and audio-only concurrently
+        # (independent, network-bound; output templates do not collide)
         # -------------------------------------------------------------------
-        rc_v, out_v, err_v = run_ytdlp_download(video_args, timeout_seconds=1800)
+        (rc_v, out_v, err_v), (rc_a, out_a, err_a) = asyncio.run(_download_streams(video_args, audio_args))
+
         if err_v:
             logger.warning("yt-dlp video stderr:\n%s", err_v.strip())
+        if err_a:
+            logger.warning("yt-dlp audio stderr:\n%s", err_a.strip())
         if rc_v != 0:
             raise RuntimeError(
                 f"yt-dlp video download failed (rc={rc_v}): {(err_v or '').strip()}"
             )
-
-        # -------------------------------------------------------------------
-        # Download audio-only
-        # -------------------------------------------------------------------
-        rc_a, out_a, err_a = run_ytdlp_download(audio_args, timeout_seconds=1800)
-        if err_a:
-            logger.warning("yt-dlp audio stderr:\n%s", err_a.strip())
         if rc_a != 0:
             raise RuntimeError(
                 f"yt-dlp audio download failed (rc={rc_a}): {(err_a or '').strip()}"
@@ -194,11 +236,8 @@ def download_av_job(video_id: str) -> Dict[str, Any]:
         # -------------------------------------------------------------------
         # Resolve actual output files
         # -------------------------------------------------------------------
-        v_paths = glob.glob(os.path.join(MEDIA_ROOT, f"{video_id}.video.*"))
-        a_paths = glob.glob(os.path.join(MEDIA_ROOT, f"{video_id}.audio.*"))
-
-        video_path = _pick_newest_nonempty(v_paths)
-        audio_path = _pick_newest_nonempty(a_paths)
+        video_path = _pick_newest_nonempty_prefixed(MEDIA_ROOT, f"{video_id}.video.")
+        audio_path = _pick_newest_nonempty_prefixed(MEDIA_ROOT, f"{video_id}.audio.")
 
         if not video_path:
             raise RuntimeError("Video download finished but output file is missing or empty")
@@ -210,10 +249,13 @@ def download_av_job(video_id: str) -> Dict[str, Any]:
             "watch_url": watch_url,
             "video_path": video_path,
             "audio_path": audio_path,
+            **_file_meta("video", video_path),
+            **_file_meta("audio", audio_path),
             "updated_at": int(time.time()),
         }
 
-        store_media(video_id, payload)
+        store_media_and_release_lock(video_id, payload)
+        lock_released = True
 
         elapsed_ms = int((time.time() - started_at) * 1000)
 
@@ -229,5 +271,7 @@ def download_av_job(video_id: str) -> Dict[str, Any]:
     finally:
         # IMPORTANT:
         # Always release the enqueue lock, even if the job fails.
-        release_lock(video_id)
+        # (On success it was already released by store_media_and_release_lock.)
+        if not lock_released:
+            release_lock(video_id)
 
@@ -1,14 +1,20 @@
 import re
 import os
-import mimetypes
+import asyncio
+import functools
+import stat
 import logging
-from typing import Optional, Dict, Any
+import tempfile
+from contextlib import asynccontextmanager
+from email.utils import formatdate
+from typing import Optional, Dict, Any, List, Tuple
 
 from fastapi import FastAPI, Path, Query, Request, HTTPException
-from fastapi.responses import Response, JSONResponse, FileResponse
+from fastapi.responses import Response, HTMLResponse, JSONResponse, FileResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.staticfiles import StaticFiles
 
+from redis.commands.core import Script
 from rq import Queue
 
 import httpx
@@ -16,7 +22,7 @@ import httpx
 from app.logging_config import setup_logging
 from app.redis_client import get_redis
 from app.ytdlp_utils import extract_youtube_id, ytdlp_print_id
-from app.jobs import get_media, download_av_job
+from app.jobs import get_media, parse_media, media_type_for, k_media, k_lock, download_av_job
 
 setup_logging()
 logger = logging.getLogger("api")
@@ -37,6 +43,31 @@ POSSIBLE_THUMBNAILS = [
     "0.jpg", "1.jpg", "2.jpg", "3.jpg",
 ]
 
+# TTLs for the remembered thumbnail candidate and for "no thumbnail" results
+THUMB_NAME_TTL_SECONDS = 7 * 24 * 3600
+THUMB_NONE_TTL_SECONDS = 600
+
+# Redis key prefixes (video ids are ASCII, so keys are built as bytes directly)
+_LAST_JOB_PREFIX = b"yt:last_job:"
+_THUMB_NAME_PREFIX = b"yt:thumb_name:"
+_THUMB_NONE_PREFIX = b"yt:thumb_none:"
+
+# GET media; if missing, SET NX the enqueue lock. Returns {media_or_nil, got_lock}.
+_ENSURE_LUA = """
+local m = redis.call('GET', KEYS[1])
+if m then
+  return {m, 0}
+end
+if redis.call('SET', KEYS[2], '1', 'NX', 'EX', ARGV[1]) then
+  return {false, 1}
+end
+return {false, 0}
+"""
+_ENSURE_SCRIPT: Optional[Script] = None
+
+# RQ queue for caching jobs (see _queue)
+_Q: Optional[Queue] = None
+
 # Strong cache hints for browsers and CDNs
 CACHE_HEADERS = {
     "Cache-Control": "public, max-age=31536000, immutable"
@@ -48,15 +79,51 @@ os.makedirs(MEDIA_ROOT, exist_ok=True)
 
 PUBLIC_BASE_URL = os.getenv("PUBLIC_BASE_URL", "http://localhost:58000")
 
-app = FastAPI(title="YT Cache API (split A/V, no ffmpeg)")
+# Optional: internal location prefix of a reverse proxy (e.g. nginx) serving MEDIA_ROOT.
+# When set, media files are handed off via X-Accel-Redirect so the proxy can use sendfile(2).
+MEDIA_ACCEL_REDIRECT = os.getenv("MEDIA_ACCEL_REDIRECT", "").rstrip("/")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared HTTP client: keep-alive/HTTP2 connections to i.ytimg.com are reused across requests
+    app.state.httpx = httpx.AsyncClient(
+        timeout=10,
+        follow_redirects=True,
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50),
+    )
+    try:
+        yield
+    finally:
+        await app.state.httpx.aclose()
+
+
+app = FastAPI(title="YT Cache API (split A/V, no ffmpeg)", lifespan=lifespan)
 
 # Jinja2 template directory (HTML is separated from Python code)
 templates = Jinja2Templates(directory="app/templates")
 
+# Stand-in for the video id when pre-rendering watch.html
+_WATCH_VID_PLACEHOLDER = "__WATCH_VIDEO_ID__"
+
 # Optional: mount static directory if you later split CSS/JS into separate files
 # app.mount("/static", StaticFiles(directory="app/static"), name="static")
 
 
+@functools.lru_cache(maxsize=1)
+def _watch_page_parts() -> List[bytes]:
+    """
+    Render watch.html once with a placeholder id and split it around the placeholder.
+    Valid video ids need no HTML/JSON escaping, so joining the parts with the id
+    yields the same output as rendering the template per request.
+    """
+    html = templates.env.get_template("watch.html").render(
+        video_id=_WATCH_VID_PLACEHOLDER,
+        public_base_url=PUBLIC_BASE_URL,
+    )
+    return html.encode("utf-8").split(_WATCH_VID_PLACEHOLDER.encode("ascii"))
+
+
 def _accepts_html(req: Request) -> bool:
     """Return True if the client prefers HTML response."""
     a = (req.headers.get("accept") or "").lower()
@@ -70,8 +137,68 @@ def _accepts_oembed(req: Request) -> bool:
 
 
 def _queue() -> Queue:
-    """Return the RQ queue for YouTube caching jobs."""
-    return Queue("yt", connection=get_redis())
+    """Return the RQ queue for YouTube caching jobs (built once, shares the pooled Redis client)."""
+    global _Q
+    if _Q is None:
+        _Q = Queue("yt", connection=get_redis())
+    return _Q
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    """Return True if an If-None-Match header value matches the given (quoted) etag."""
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _media_file_response(request: Request, media: Dict[str, Any], kind: str) -> Response:
+    """
+    Serve a cached media file ("video" or "audio"), offloading to the reverse proxy when configured.
+
+    Response metadata (size, mtime, content type, etag) is read from the stored payload,
+    so conditional requests are answered with 304 without touching the filesystem.
+    Older payloads without that metadata fall back to stat-based headers.
+    """
+    p = media[f"{kind}_path"]
+    media_type = media.get(f"{kind}_mime") or media_type_for(p)
+    size = media.get(f"{kind}_size")
+    mtime = media.get(f"{kind}_mtime")
+    etag = media.get(f"{kind}_etag")
+
+    headers = dict(CACHE_HEADERS)
+    stat_result = None
+    if size is not None and mtime is not None and etag:
+        headers["ETag"] = f'"{etag}"'
+        headers["Last-Modified"] = formatdate(mtime, usegmt=True)
+
+        inm = request.headers.get("if-none-match")
+        if inm and _etag_matches(inm, headers["ETag"]):
+            return Response(status_code=304, headers=headers)
+
+        # Pre-built stat result: FileResponse then skips its own os.stat()
+        stat_result = os.stat_result((stat.S_IFREG | 0o644, 0, 0, 1, 0, 0, size, mtime, mtime, mtime))
+
+    if MEDIA_ACCEL_REDIRECT:
+        return Response(
+            status_code=200,
+            media_type=media_type,
+            headers={
+                "X-Accel-Redirect": f"{MEDIA_ACCEL_REDIRECT}/{os.path.basename(p)}",
+                **headers,
+            },
+        )
+
+    # FileResponse honours Range/If-Range (206 partial content, multi-range, 416),
+    # so seeking in <video>/<audio> only transfers the requested byte window.
+    return FileResponse(
+        p,
+        media_type=media_type,
+        filename=os.path.basename(p),
+        headers=headers,
+        stat_result=stat_result,
+    )
 
 
 def resolve_video_id(
@@ -108,6 +235,41 @@ def resolve_video_id(
     return None
 
 
+def _media_ready(media: Optional[Dict[str, Any]]) -> bool:
+    """Return True if both video and audio files are cached."""
+    return bool(media and media.get("video_path") and media.get("audio_path"))
+
+
+def _ensure_script() -> Script:
+    """Return the get-or-lock Lua script (registered once, called via EVALSHA)."""
+    global _ENSURE_SCRIPT
+    if _ENSURE_SCRIPT is None:
+        _ENSURE_SCRIPT = get_redis().register_script(_ENSURE_LUA)
+    return _ENSURE_SCRIPT
+
+
+def _fetch_and_lock(video_id: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Read media metadata or, if missing, take the enqueue lock in one atomic round-trip.
+
+    Returns (media, got_lock). The lock is never taken when media already exists.
+    """
+    raw, got_lock = _ensure_script()(keys=[k_media(video_id), k_lock(video_id)], args=[600])  # 10 minutes lock
+    return parse_media(raw), bool(got_lock)
+
+
+def _enqueue_cache_job(video_id: str) -> str:
+    """Enqueue the caching job. The caller must already hold the enqueue lock."""
+    pipe = get_redis().pipeline(transaction=False)
+    job = _queue().enqueue(download_av_job, video_id, job_timeout=3600, pipeline=pipe)
+
+    # Store last job id for debugging/status (same round-trip as the enqueue writes)
+    pipe.set(_LAST_JOB_PREFIX + video_id.encode(), job.id.encode("utf-8"), ex=3600)
+    pipe.execute()
+
+    return job.id
+
+
 def ensure_cache_request(video_id: str) -> str:
     """
     Enqueue caching job if media is not ready.
@@ -116,26 +278,12 @@ def ensure_cache_request(video_id: str) -> str:
     - Uses a Redis lock to deduplicate repeated enqueue calls during HTML polling.
     - Releases lock is handled by the job's finally block (jobs.py).
     """
-    media = get_media(video_id)
-    if media and media.get("video_path") and media.get("audio_path"):
-        return ""
-
-    r = get_redis()
-
-    lock_key = f"yt:lock:{video_id}".encode("utf-8")
-    got_lock = r.set(lock_key, b"1", nx=True, ex=600)  # 10 minutes lock
-
-    if not got_lock:
-        # A job is already queued/running.
+    media, got_lock = _fetch_and_lock(video_id)
+    if _media_ready(media) or not got_lock:
+        # Either cached already, or a job is already queued/running.
         return ""
 
-    q = _queue()
-    job = q.enqueue(download_av_job, video_id, job_timeout=3600)
-
-    # Store last job id for debugging/status
-    r.set(f"yt:last_job:{video_id}".encode("utf-8"), job.id.encode("utf-8"), ex=3600)
-
-    return job.id
+    return _enqueue_cache_job(video_id)
 
 
 def status_payload(video_id: str) -> Dict[str, Any]:
@@ -143,8 +291,8 @@ def status_payload(video_id: str) -> Dict[str, Any]:
     Build a stable JSON payload for status checking.
     Always schedules caching when not ready.
     """
-    media = get_media(video_id)
-    if media and media.get("video_path") and media.get("audio_path"):
+    media, got_lock = _fetch_and_lock(video_id)
+    if _media_ready(media):
         return {
             "ok": True,
             "ready": True,
@@ -155,7 +303,7 @@ def status_payload(video_id: str) -> Dict[str, Any]:
             "job_id": None,
         }
 
-    job_id = ensure_cache_request(video_id)
+    job_id = _enqueue_cache_job(video_id) if got_lock else ""
     return {
         "ok": True,
         "ready": False,
@@ -271,19 +419,12 @@ async def watch_page(request: Request, path_video_id: str):
     # Always ensure a cache request is scheduled if missing.
     ensure_cache_request(vid)
 
-    # Render external template
-    return templates.TemplateResponse(
-        "watch.html",
-        {
-            "request": request,  # REQUIRED for Jinja2Templates
-            "video_id": vid,
-            "public_base_url": PUBLIC_BASE_URL,
-        },
-    )
+    # Splice the id into the pre-rendered template (no per-request Jinja rendering)
+    return HTMLResponse(vid.encode("ascii").join(_watch_page_parts()))
 
 
 @app.get("/media/{video_id}/video")
-def media_video(video_id: str):
+def media_video(request: Request, video_id: str):
     """
     Serve cached video-only file.
     If missing, auto-enqueue caching and return 404.
@@ -297,13 +438,11 @@ def media_video(video_id: str):
         ensure_cache_request(vid)
         raise HTTPException(status_code=404, detail="Video not cached yet")
 
-    p = media["video_path"]
-    mime, _ = mimetypes.guess_type(p)
-    return FileResponse(p, media_type=(mime or "application/octet-stream"), filename=os.path.basename(p), headers=CACHE_HEADERS)
+    return _media_file_response(request, media, "video")
 
 
 @app.get("/media/{video_id}/audio")
-def media_audio(video_id: str):
+def media_audio(request: Request, video_id: str):
     """
     Serve cached audio-only file.
     If missing, auto-enqueue caching and return 404.
@@ -317,60 +456,183 @@ def media_audio(video_id: str):
         ensure_cache_request(vid)
         raise HTTPException(status_code=404, detail="Audio not cached yet")
 
-    p = media["audio_path"]
-    mime, _ = mimetypes.guess_type(p)
-    return FileResponse(p, media_type=(mime or "application/octet-stream"), filename=os.path.basename(p), headers=CACHE_HEADERS)
+    return _media_file_response(request, media, "audio")
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_thumbnail(path: str, mtime_ns: int, size: int) -> bytes:
+    """
+    Read a cached thumbnail file into a small in-memory LRU.
+    mtime/size are part of the cache key, so a replaced file is read again.
+    """
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_atomic(path: str, data: bytes) -> None:
+    """Write via a temp file + os.replace so readers never see a partial/empty file."""
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f".{os.path.basename(path)}.")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+async def _fetch_thumbnail(client: httpx.AsyncClient, base_url: str, name: str) -> httpx.Response:
+    """Fetch a single thumbnail candidate (upstream errors become 502)."""
+    url = f"{base_url}/{name}"
+    try:
+        return await client.get(url)
+    except httpx.HTTPError as e:
+        logger.info("Thumbnail fetch failed: %s (%s)", url, e)
+        raise HTTPException(status_code=502)
+
+
+async def _race_thumbnails(
+    client: httpx.AsyncClient,
+    base_url: str,
+    names: List[str],
+) -> Tuple[Optional[Tuple[str, httpx.Response]], bool]:
+    """
+    Fetch the given candidates concurrently, but accept them in priority order:
+    a later candidate is used only once every earlier one finished with a non-200.
+    Total latency is bounded by the slowest request instead of their sum.
+
+    Returns ((name, response) or None, errored). A transport error is not fatal,
+    but it is not a definite miss either: `errored` is True if a candidate ranked
+    above the hit (or any candidate, when there is no hit) failed.
+    """
+    tasks = [asyncio.create_task(client.get(f"{base_url}/{name}")) for name in names]
+    errored = False
+    try:
+        for name, task in zip(names, tasks):
+            try:
+                resp = await task
+            except httpx.HTTPError as e:
+                # Not a fatal error: move on to the next thumbnail candidate
+                logger.info("Thumbnail not available, trying next candidate: %s/%s (%s)", base_url, name, e)
+                errored = True
+                continue
+            if resp.status_code == 200:
+                return (name, resp), errored
+        return None, errored
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _probe_thumbnail_name(
+    client: httpx.AsyncClient,
+    base_url: str,
+    names: List[str],
+) -> Tuple[Optional[str], bool]:
+    """
+    Probe the given thumbnail candidates concurrently with HEAD requests.
+
+    Returns (highest-priority name that exists or None, errored), where `errored`
+    has the same meaning as in _race_thumbnails.
+    """
+    results = await asyncio.gather(
+        *[client.head(f"{base_url}/{name}") for name in names],
+        return_exceptions=True,
+    )
+    errored = False
+    for name, res in zip(names, results):
+        if isinstance(res, Exception):
+            # Not a fatal error: move on to the next thumbnail candidate
+            logger.info("Thumbnail probe failed, trying next candidate: %s/%s (%s)", base_url, name, res)
+            errored = True
+            continue
+        if res.status_code == 200:
+            return name, errored
+    return None, errored
 
 
 @app.get("/media/{video_id}/thumbnail")
 async def thumbnail(
+    request: Request,
     # Validate video_id at the routing level using Path + regex
     video_id: str = Path(..., pattern=VIDEO_ID_REGEX),
 ):
     # Local thumbnail cache path (single best thumbnail per video)
     thumb_path = os.path.join(MEDIA_ROOT, f"{video_id}.thumb.jpg")
 
-    # 1) Local cache hit: serve immediately
-    if os.path.exists(thumb_path):
-        with open(thumb_path, "rb") as f:
-            return Response(
-                f.read(),
-                media_type="image/jpeg",
-                headers=CACHE_HEADERS,
-            )
+    # 1) Local cache hit: serve immediately from the in-memory cache
+    try:
+        st = os.stat(thumb_path)
+    except FileNotFoundError:
+        st = None
+    if st is not None and st.st_size > 0:
+        return Response(
+            _cached_thumbnail(thumb_path, st.st_mtime_ns, st.st_size),
+            media_type="image/jpeg",
+            headers=CACHE_HEADERS,
+        )
+
+    r = get_redis()
+
+    # 2) Known miss: skip probing YouTube again for a while
+    if r.exists(_THUMB_NONE_PREFIX + video_id.encode()):
+        raise HTTPException(status_code=404)
 
     # Base URL for YouTube thumbnail assets
     base_url = f"https://i.ytimg.com/vi/{video_id}"
+    name_key = _THUMB_NAME_PREFIX + video_id.encode()
+
+    client: httpx.AsyncClient = request.app.state.httpx
+
+    # 3) Use the remembered candidate, or fetch the two most likely ones concurrently
+    #    and fall back to probing the rest (HEAD only) if neither exists.
+    #    If a higher-priority candidate failed with a transport error, the best
+    #    available thumbnail is still served, but nothing is cached.
+    errored = False
+    cached_name = r.get(name_key)
+    if cached_name:
+        name = cached_name.decode("utf-8")
+        resp = await _fetch_thumbnail(client, base_url, name)
+    else:
+        hit, errored = await _race_thumbnails(client, base_url, POSSIBLE_THUMBNAILS[:2])
+        if hit:
+            name, resp = hit
+        else:
+            name, probe_errored = await _probe_thumbnail_name(client, base_url, POSSIBLE_THUMBNAILS[2:])
+            errored = errored or probe_errored
+            if not name:
+                if errored:
+                    raise HTTPException(status_code=502)
+                r.set(_THUMB_NONE_PREFIX + video_id.encode(), b"1", ex=THUMB_NONE_TTL_SECONDS)
+                raise HTTPException(status_code=404)
+            resp = await _fetch_thumbnail(client, base_url, name)
+        if not errored:
+            r.set(name_key, name.encode("utf-8"), ex=THUMB_NAME_TTL_SECONDS)
+
+    if resp.status_code != 200:
+        # Remembered candidate went away; probe again on the next request
+        r.delete(name_key)
+        raise HTTPException(status_code=404)
 
-    # 2) Try possible thumbnails in order and cache the first successful one
-    async with httpx.AsyncClient(timeout=10, follow_redirects=True) as client:
-        for name in POSSIBLE_THUMBNAILS:
-            url = f"{base_url}/{name}"
-            try:
-                r = await client.get(url)
-                if r.status_code != 200:
-                    continue
-
-                # Save to local cache
-                with open(thumb_path, "wb") as f:
-                    f.write(r.content)
-
-                return Response(
-                    r.content,
-                    media_type="image/jpeg",
-                    headers=CACHE_HEADERS,
-                )
-            except httpx.HTTPError as e:
-                # Not a fatal error: move on to the next thumbnail candidate
-                logger.info(
-                    "Thumbnail not available, trying next candidate: %s (%s)",
-                    url,
-                    e,
-                )
-                continue
-
-    # No thumbnail was found
-    raise HTTPException(status_code=404)
+    if errored:
+        # Possibly not the best thumbnail: do not let browsers/CDNs keep it either
+        return Response(
+            resp.content,
+            media_type="image/jpeg",
+            headers={"Cache-Control": "no-store"},
+        )
+
+    # Save to local cache
+    _write_atomic(thumb_path, resp.content)
+
+    return Response(
+        resp.content,
+        media_type="image/jpeg",
+        headers=CACHE_HEADERS,
+    )
 
 
 @app.get("/media/{video_id}/subtitles")
@@ -1,8 +1,21 @@
 import os
+from typing import Optional
+
 from redis import Redis
 
-def get_redis() -> Redis:
-    url = os.getenv("REDIS_URL", "redis://redis:6379/0")
-    # IMPORTANT: Must be raw bytes for RQ compatibility
-    return Redis.from_url(url, decode_responses=False)
+# Shared client; its connection pool is thread-safe and reused across calls.
+_client: Optional[Redis] = None
 
+def get_redis() -> Redis:
+    global _client
+    if _client is None:
+        url = os.getenv("REDIS_URL", "redis://redis:6379/0")
+        # IMPORTANT: Must be raw bytes for RQ compatibility
+        _client = Redis.from_url(
+            url,
+            decode_responses=False,
+            max_connections=64,
+            socket_keepalive=True,
+            health_check_interval=30,
+        )
+    return _client
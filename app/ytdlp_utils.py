@@ -1,71 +1,132 @@
 import re
+import asyncio
+import functools
 import subprocess
-from typing import Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional, Tuple
+
+from yt_dlp import YoutubeDL
 
 _YT_ID_RE = re.compile(r"^[a-zA-Z0-9_-]{11}$")
 
+# ?v=<id>, youtu.be/<id>, /shorts/<id>, /embed/<id> in a single pass
+_YT_URL_ID_RE = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/)([a-zA-Z0-9_-]{11})")
+
+# Longest input memoized by extract_youtube_id
+_MEMO_MAX_INPUT_LEN = 256
+
+# yt-dlp options for id resolution (mirrors the former CLI flags)
+_YDL_ID_OPTS = {
+    "quiet": True,
+    "no_warnings": True,
+    "noplaylist": True,
+    "skip_download": True,
+    "js_runtimes": {"deno": {}},
+    "extractor_args": {"youtube": {"player_client": ["android"]}},
+    "source_address": "0.0.0.0",  # force IPv4
+}
+
+# How many url results (redirects/shortlinks) ytdlp_print_id follows
+_MAX_URL_RESULT_HOPS = 3
+
+# Runs id extraction so ytdlp_print_id can enforce a wall-clock deadline
+_ID_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ytdlp-id")
+
 def extract_youtube_id(url_or_id: str) -> Optional[str]:
     """
     Extract 11-char YouTube video id from common URL forms or accept direct id.
+    Memoized for short inputs: polling clients resolve the same inputs repeatedly,
+    while arbitrary long query strings must not pin cache memory.
     """
     if not url_or_id:
         return None
 
+    if len(url_or_id) > _MEMO_MAX_INPUT_LEN:
+        return _extract_youtube_id(url_or_id)
+    return _extract_youtube_id_cached(url_or_id)
+
+@functools.lru_cache(maxsize=16384)
+def _extract_youtube_id_cached(url_or_id: str) -> Optional[str]:
+    return _extract_youtube_id(url_or_id)
+
+def _extract_youtube_id(url_or_id: str) -> Optional[str]:
     s = url_or_id.strip()
 
-    if _YT_ID_RE.match(s):
+    if len(s) == 11 and _YT_ID_RE.match(s):
         return s
 
-    m = re.search(r"[?&]v=([a-zA-Z0-9_-]{11})", s)
+    m = _YT_URL_ID_RE.search(s)
     if m:
         return m.group(1)
 
-    m = re.search(r"youtu\.be/([a-zA-Z0-9_-]{11})", s)
-    if m:
-        return m.group(1)
+    return None
 
-    m = re.search(r"/shorts/([a-zA-Z0-9_-]{11})", s)
-    if m:
-        return m.group(1)
+def _extract_id(url: str, socket_timeout: int) -> Optional[str]:
+    """
+    Run yt-dlp id extraction (blocking).
 
-    m = re.search(r"/embed/([a-zA-Z0-9_-]{11})", s)
-    if m:
-        return m.group(1)
+    With process=False yt-dlp returns the raw extractor result, so redirects and
+    shortlinks come back as url results ({"_type": "url", "url": ...}) without an id.
+    Those are followed here (a few hops at most) like `--print id` would.
+    """
+    opts = dict(_YDL_ID_OPTS, socket_timeout=socket_timeout)
+    # A fresh YoutubeDL per call: instances are not safe to share across threads
+    with YoutubeDL(opts) as ydl:
+        for _ in range(_MAX_URL_RESULT_HOPS + 1):
+            info = ydl.extract_info(url, download=False, process=False) or {}
+            if info.get("_type") not in ("url", "url_transparent"):
+                vid = str(info.get("id") or "").strip()
+                return vid if _YT_ID_RE.match(vid) else None
 
+            url = info.get("url") or ""
+            vid = extract_youtube_id(url)
+            if vid or not url:
+                return vid
     return None
 
 def ytdlp_print_id(url: str, timeout_seconds: int = 20) -> Optional[str]:
     """
-    Resolve id via yt-dlp without downloading.
-    """
-    args = [
-        "yt-dlp",
-        "--js-runtimes", "deno",
-        "--no-playlist",
-        "--skip-download",
-        "--print", "id",
-        "--extractor-args", "youtube:player_client=android",
-        "--force-ipv4",
-        url,
-    ]
-    proc = subprocess.run(args, capture_output=True, text=True, timeout=timeout_seconds)
-    if proc.returncode != 0:
-        return None
+    Resolve id via yt-dlp (in-process, no subprocess) without downloading.
 
-    line = (proc.stdout or "").strip().splitlines()[:1]
-    if not line:
+    `timeout_seconds` is a wall-clock limit on the whole extraction (retries and
+    JS challenge solving included); on expiry None is returned. The extraction
+    cannot be interrupted, so it finishes in the background on a bounded pool.
+    """
+    fut = _ID_EXECUTOR.submit(_extract_id, url, timeout_seconds)
+    try:
+        return fut.result(timeout=timeout_seconds)
+    except Exception:
+        fut.cancel()
         return None
 
-    vid = line[0].strip()
-    return vid if _YT_ID_RE.match(vid) else None
-
 def build_watch_url(video_id: str) -> str:
     return f"https://www.youtube.com/watch?v={video_id}"
 
-def run_ytdlp_download(args: list[str], timeout_seconds: int) -> Tuple[int, str, str]:
+async def run_ytdlp_download_async(args: list[str], timeout_seconds: int) -> Tuple[int, str, str]:
     """
-    Run yt-dlp and return (returncode, stdout, stderr).
+    Run yt-dlp and return (returncode, stdout, stderr); the event loop stays free while it runs.
+    Raises subprocess.TimeoutExpired on timeout. If the call times out, fails or is
+    cancelled (e.g. a sibling download failed), the yt-dlp process is killed and reaped.
     """
-    proc = subprocess.run(args, capture_output=True, text=True, timeout=timeout_seconds)
-    return proc.returncode, proc.stdout or "", proc.stderr or ""
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout_seconds)
+    except asyncio.TimeoutError:
+        raise subprocess.TimeoutExpired(args, timeout_seconds)
+    finally:
+        if proc.returncode is None:
+            try:
+                proc.kill()
+            except ProcessLookupError:
+                pass
+            await proc.wait()
 
+    return (
+        proc.returncode,
+        (out or b"").decode("utf-8", errors="replace"),
+        (err or b"").decode("utf-8", errors="replace"),
+    )